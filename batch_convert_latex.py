@@ -7,7 +7,7 @@ It processes all U3D files in a directory and creates PDFs that will work correc
 in Adobe Acrobat Reader.
 
 Usage:
-    python batch_convert_latex.py [--source-dir DIR] [--output-dir DIR] [--template FILE]
+    python batch_convert_latex.py [--source-dir DIR] [--output-dir DIR] [--template FILE] [--jobs N]
 
 Example:
     python batch_convert_latex.py --source-dir ../obj_to_u3d/output --output-dir pdf
@@ -17,7 +17,11 @@ import os
 import sys
 import argparse
 import logging
-import glob
+import asyncio
+import json
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Configure logging
@@ -27,31 +31,83 @@ logger = logging.getLogger(__name__)
 
 # Import the generate_3d_pdf function from our module
 try:
-    from latex_3d_pdf import generate_3d_pdf, check_media9_package, find_pdflatex
+    from latex_3d_pdf import (generate_3d_pdf_async, check_media9_package, find_pdflatex,
+                              build_format, read_template, mark_preamble_end,
+                              LatexTemplate, PrecompiledFormat, DEFAULT_TEMPLATE)
 except ImportError:
     logger.error("Could not import latex_3d_pdf module. Make sure latex_3d_pdf.py is in the same directory.")
     sys.exit(1)
 
+# Subdirectory of the output directory holding precompiled LaTeX formats
+FORMAT_DIR = ".u3dpdf"
+
+# Number of threads used to check U3D file headers
+CHECK_WORKERS = 16
+
+# Results of the dependency check are cached here and reused for a day
+DEPS_CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                               "u3d_pdf", "deps.json")
+DEPS_CACHE_MAX_AGE = 24 * 60 * 60
+
 def find_u3d_files(source_dir):
-    """Find all U3D files in the source directory"""
+    """Find all U3D files in the source directory and split them into valid and invalid files"""
     if not os.path.exists(source_dir):
         logger.error(f"Source directory not found: {source_dir}")
-        return []
+        return [], []
+    
+    try:
+        with os.scandir(source_dir) as entries:
+            candidates = sorted((entry for entry in entries
+                                 if entry.name.endswith(".u3d")
+                                 and not entry.name.startswith(".")
+                                 and entry.is_file()),
+                                key=lambda entry: entry.name)
+    except OSError as e:
+        logger.error(f"Cannot read source directory {source_dir}: {str(e)}")
+        return [], []
+    logger.info(f"Found {len(candidates)} U3D files in {source_dir}")
     
-    u3d_files = glob.glob(os.path.join(source_dir, "*.u3d"))
-    logger.info(f"Found {len(u3d_files)} U3D files in {source_dir}")
+    u3d_files = []
+    invalid_files = []
     
-    return u3d_files
+    # Files that vanish or can't be read between listing and stat are invalid
+    paths = []
+    sizes = []
+    for entry in candidates:
+        try:
+            sizes.append(entry.stat().st_size)
+            paths.append(entry.path)
+        except OSError as e:
+            logger.error(f"Error reading U3D file {entry.path}: {str(e)}")
+            invalid_files.append(entry.path)
+    
+    # Header checks are small blocking reads, so run them in threads
+    with ThreadPoolExecutor(max_workers=CHECK_WORKERS) as executor:
+        checks = list(executor.map(check_u3d_file, paths, sizes))
+    
+    for path, valid in zip(paths, checks):
+        if valid:
+            u3d_files.append(path)
+        else:
+            logger.warning(f"Skipping invalid U3D file: {path}")
+            invalid_files.append(path)
+    
+    return u3d_files, invalid_files
 
-def check_u3d_file(u3d_file):
+def check_u3d_file(u3d_file, size=None):
     """Check if a U3D file appears to be valid"""
-    # Verify file exists
-    if not os.path.exists(u3d_file):
-        logger.error(f"U3D file not found: {u3d_file}")
-        return False
+    # Verify file exists and get its size
+    if size is None:
+        try:
+            size = os.stat(u3d_file).st_size
+        except FileNotFoundError:
+            logger.error(f"U3D file not found: {u3d_file}")
+            return False
+        except OSError as e:
+            logger.error(f"Error reading U3D file {u3d_file}: {str(e)}")
+            return False
     
     # Check file size
-    size = os.path.getsize(u3d_file)
     if size < 100:
         logger.warning(f"U3D file {os.path.basename(u3d_file)} is suspiciously small ({size} bytes), may not be valid")
         return False
@@ -69,14 +125,72 @@ def check_u3d_file(u3d_file):
     
     return True
 
-def check_dependencies():
-    """Check if required dependencies are installed"""
+def load_cached_dependencies():
+    """Return the cached pdflatex path if the dependency cache is still valid"""
+    try:
+        with open(DEPS_CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    # Anything unexpected in the file just makes the cache invalid
+    if not isinstance(cache, dict):
+        return None
+    if cache.get('path') != os.environ.get('PATH', ''):
+        return None
+    
+    mtime = cache.get('mtime')
+    if not isinstance(mtime, (int, float)) or isinstance(mtime, bool):
+        return None
+    age = time.time() - mtime
+    if age < 0 or age > DEPS_CACHE_MAX_AGE:
+        return None
+    
+    pdflatex = cache.get('pdflatex')
+    media9 = cache.get('media9')
+    if not isinstance(pdflatex, str) or not isinstance(media9, str):
+        return None
+    if not pdflatex or not media9:
+        return None
+    if not os.path.isfile(pdflatex) or not os.path.isfile(media9):
+        return None
+    
+    return pdflatex
+
+def save_cached_dependencies(pdflatex, media9):
+    """Store the dependency check results in the cache file"""
+    cache = {
+        'pdflatex': pdflatex,
+        'media9': media9,
+        'path': os.environ.get('PATH', ''),
+        'mtime': time.time()
+    }
+    try:
+        cache_dir = os.path.dirname(DEPS_CACHE_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial file
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.replace(temp_file, DEPS_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"Could not write dependency cache: {str(e)}")
+
+def check_dependencies(use_cache=True):
+    """Check if required dependencies are installed and return the path to pdflatex"""
+    if use_cache:
+        pdflatex = load_cached_dependencies()
+        if pdflatex:
+            logger.info(f"Using cached dependency check: pdflatex at {pdflatex}")
+            return pdflatex
+    
     pdflatex = find_pdflatex()
     media9 = check_media9_package()
     
     if pdflatex and media9:
         logger.info("All required dependencies are installed")
-        return True
+        save_cached_dependencies(pdflatex, media9)
+        return pdflatex
     
     if not pdflatex:
         logger.error("pdflatex not found. Please install LaTeX (MacTeX, TeX Live, or MiKTeX)")
@@ -89,50 +203,94 @@ def check_dependencies():
         logger.error("Please install it using your TeX package manager:")
         logger.error("  tlmgr install media9")
     
-    return False
+    return None
 
-def process_u3d_files(u3d_files, output_dir, template=None):
+def process_u3d_files(u3d_files, output_dir, template_content=None, jobs=None, pdflatex=None,
+                      precompile_format=False):
     """Process a list of U3D files and convert them to 3D PDFs using LaTeX"""
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         logger.info(f"Created output directory: {output_dir}")
     
     results = []
+    pending = []
+    
+    output_path = Path(output_dir)
     
     for u3d_file in u3d_files:
-        # First check if the U3D file is valid
-        if not check_u3d_file(u3d_file):
-            logger.warning(f"Skipping invalid U3D file: {u3d_file}")
-            results.append({
-                'u3d_file': u3d_file,
-                'pdf_file': None,
-                'success': False,
-                'reason': 'Invalid U3D file'
-            })
-            continue
-        
         # Get the base filename without extension
-        base_name = os.path.splitext(os.path.basename(u3d_file))[0]
+        base_name = Path(u3d_file).stem
         
         # Create output PDF path
-        pdf_file = os.path.join(output_dir, f"{base_name}.pdf")
+        pdf_file = output_path / f"{base_name}.pdf"
         
         # Title for the PDF (use the base filename with spaces instead of underscores)
         title = base_name.replace('_', ' ').title()
         
-        logger.info(f"Converting {u3d_file} to {pdf_file}")
-        
-        # Convert the U3D file to PDF using LaTeX
-        success = generate_3d_pdf(u3d_file, pdf_file, title, template)
+        pending.append((u3d_file, pdf_file, title))
+    
+    if not pending:
+        return results
+    
+    format_file = None
+    if precompile_format and len(pending) > 1:
+        if not pdflatex:
+            pdflatex = find_pdflatex()
+        if pdflatex:
+            format_dir = os.path.join(output_dir, FORMAT_DIR)
+            format_file = build_format(pdflatex, template_content or DEFAULT_TEMPLATE.template,
+                                       format_dir)
+    
+    # Build the template once for the whole batch
+    if template_content is None:
+        template = DEFAULT_TEMPLATE
+    else:
+        template = LatexTemplate(template_content)
+    if format_file:
+        template = mark_preamble_end(template.template)
+    
+    max_workers = min(jobs or os.cpu_count() or 1, len(pending))
+    logger.info(f"Converting {len(pending)} files using {max_workers} worker(s)")
+    
+    results += asyncio.run(convert_files(pending, template, max_workers, pdflatex, format_file))
+    
+    return results
+
+async def convert_files(pending, template, max_workers, pdflatex=None, format_file=None):
+    """Convert (u3d_file, pdf_file, title) tuples concurrently"""
+    # Allow twice as many conversions as pdflatex processes, so LaTeX files are
+    # prepared and finished conversions cleaned up while pdflatex is running
+    pdflatex_slots = asyncio.Semaphore(max_workers)
+    conversion_slots = asyncio.Semaphore(2 * max_workers)
+    
+    # Shared by all conversions, so a broken format is dropped for the whole batch
+    shared_format = PrecompiledFormat(format_file) if format_file else None
+    
+    async def convert(u3d_file, pdf_file, title):
+        async with conversion_slots:
+            logger.info(f"Converting {u3d_file} to {pdf_file}")
+            
+            # Convert the U3D file to PDF using LaTeX
+            try:
+                # The files were checked by find_u3d_files() already
+                success = await generate_3d_pdf_async(u3d_file, pdf_file, title, template,
+                                                      pdflatex, shared_format,
+                                                      skip_validation=True,
+                                                      semaphore=pdflatex_slots)
+                reason = None if success else 'LaTeX compilation failed'
+            except Exception as e:
+                logger.error(f"Error converting {u3d_file}: {str(e)}")
+                success = False
+                reason = f'Conversion error: {str(e)}'
         
-        results.append({
+        return {
             'u3d_file': u3d_file,
             'pdf_file': pdf_file,
             'success': success,
-            'reason': None if success else 'LaTeX compilation failed'
-        })
+            'reason': reason
+        }
     
-    return results
+    return await asyncio.gather(*(convert(*item) for item in pending))
 
 def summarize_results(results):
     """Summarize the conversion results"""
@@ -166,25 +324,43 @@ def main():
     parser.add_argument("--template", 
                         help="Custom LaTeX template file")
     parser.add_argument("--check-deps", action="store_true",
-                        help="Check for required dependencies before running")
+                        help="Check for required dependencies again instead of using the cached result")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="Number of files to convert in parallel (default: number of CPU cores)")
+    parser.add_argument("--precompile-format", action="store_true",
+                        help="Precompile the template preamble into a LaTeX format shared by all files (experimental)")
     
     args = parser.parse_args()
     
-    # Check dependencies if requested
-    if args.check_deps or True:  # Always check dependencies
-        if not check_dependencies():
-            logger.error("Missing required dependencies. Exiting.")
-            sys.exit(1)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    
+    # Always check dependencies, --check-deps bypasses the cached result
+    pdflatex = check_dependencies(use_cache=not args.check_deps)
+    if not pdflatex:
+        logger.error("Missing required dependencies. Exiting.")
+        sys.exit(1)
     
     # Find U3D files
-    u3d_files = find_u3d_files(args.source_dir)
+    u3d_files, invalid_files = find_u3d_files(args.source_dir)
     
-    if not u3d_files:
+    if not u3d_files and not invalid_files:
         logger.error("No U3D files found. Exiting.")
         sys.exit(1)
     
+    results = [{
+        'u3d_file': u3d_file,
+        'pdf_file': None,
+        'success': False,
+        'reason': 'Invalid U3D file'
+    } for u3d_file in invalid_files]
+    
+    # Read the template once for all files
+    template_content = read_template(args.template)
+    
     # Process the files
-    results = process_u3d_files(u3d_files, args.output_dir, args.template)
+    results += process_u3d_files(u3d_files, args.output_dir, template_content, args.jobs, pdflatex,
+                                 args.precompile_format)
     
     # Summarize the results
     summarize_results(results)
@@ -7,7 +7,7 @@ It generates a LaTeX file, compiles it with pdflatex, and produces a PDF with
 an embedded interactive 3D model.
 
 Requirements:
-- Python 3.6+
+- Python 3.8+
 - A LaTeX distribution with the media9 package (MacTeX, TeX Live, or MiKTeX)
 - U3D files to embed
 
@@ -20,11 +20,19 @@ Example:
 
 import os
 import sys
+import asyncio
 import argparse
 import logging
 import tempfile
 import subprocess
 import shutil
+import errno
+import hashlib
+import string
+import re
+from collections import deque
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
 
 # Configure logging
@@ -32,8 +40,20 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class LatexTemplate(string.Template):
+    """Template with __TITLE__ and __MODEL_PATH__ placeholders, which don't clash with LaTeX's $"""
+    flags = 0
+    pattern = r"""
+    __(?:
+      (?P<named>TITLE|MODEL_PATH)__ |
+      (?P<braced>(?!)) |
+      (?P<escaped>(?!)) |
+      (?P<invalid>(?!))
+    )
+    """
+
 # Default LaTeX template for embedding U3D models
-DEFAULT_TEMPLATE = r"""
+DEFAULT_TEMPLATE = LatexTemplate(r"""
 \documentclass{article}
 \usepackage[margin=1in]{geometry}
 \usepackage{media9}
@@ -72,49 +92,118 @@ Use your mouse to rotate, scroll to zoom, and right-click for more options.}
 \end{center}
 
 \end{document}
-"""
+""")
+
+# Log messages asking for another pdflatex run, e.g. to resolve references
+RERUN_MESSAGES = (
+    "Rerun to get",
+    "Label(s) may have changed",
+    "Please rerun LaTeX",
+)
+
+# Upper limit on pdflatex runs per document
+MAX_PASSES = 3
+
+def needs_rerun(latex_file):
+    """Check if the pdflatex log of a LaTeX file asks for another run"""
+    log_file = os.path.splitext(latex_file)[0] + ".log"
+    try:
+        with open(log_file, "r", errors="replace") as f:
+            log = f.read()
+    except OSError:
+        return False
+    return any(message in log for message in RERUN_MESSAGES)
+
+# Auxiliary files pdflatex may leave next to the LaTeX file
+AUX_EXTENSIONS = ('.aux', '.log', '.out', '.toc', '.lof', '.lot', '.fls')
+
+# Marks the end of the preamble stored in a precompiled format. When the
+# document is compiled with that format, mylatexformat skips everything up to
+# this marker; without a format it expands to \relax and does nothing.
+ENDOFDUMP = r"\csname endofdump\endcsname"
+
+# Packages that don't survive being dumped into a format by mylatexformat
+# (they write PDF objects or set up hooks at load time); the precompiled
+# preamble ends before the first of them
+FORMAT_EXCLUDED_PACKAGES = {"hyperref", "media9", "pdfbase", "ocgx2", "movie15"}
+
+# Matches \usepackage[...]{a,b} and \RequirePackage lines, capturing the package list
+PACKAGE_PATTERN = re.compile(r"\\(?:usepackage|RequirePackage)\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}")
+
+def loads_excluded_package(line):
+    """Check if a template line loads a package listed in FORMAT_EXCLUDED_PACKAGES"""
+    for match in PACKAGE_PATTERN.finditer(line):
+        packages = {name.strip() for name in match.group(1).split(",")}
+        if packages & FORMAT_EXCLUDED_PACKAGES:
+            return True
+    return False
+
+def split_preamble(template_content):
+    """Split a template into the static preamble that can be precompiled and the rest"""
+    # Everything before the first placeholder, excluded package or
+    # \begin{document} is the same for every document
+    lines = template_content.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if (LatexTemplate.pattern.search(line) or loads_excluded_package(line)
+                or r"\begin{document}" in line):
+            return "".join(lines[:i]), "".join(lines[i:])
+    return "", template_content
+
+def list_dir(path):
+    """Return the sorted entry names of a directory, or [] if it can't be read"""
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries)
+    except OSError:
+        return []
 
+def texlive_candidates(texlive_root, executable):
+    """Yield paths of an executable in TeX Live installs, newest year first"""
+    years = [name for name in list_dir(texlive_root)
+             if len(name) == 4 and name.startswith("20") and name.isdigit()]
+    for year in reversed(years):
+        bin_dir = os.path.join(texlive_root, year, "bin")
+        for platform in list_dir(bin_dir):
+            yield os.path.join(bin_dir, platform, executable)
+
+def prefixed_dir_candidates(parent, prefix, relative_path):
+    """Yield relative_path inside each directory of parent whose name starts with prefix"""
+    for name in reversed(list_dir(parent)):
+        if name.startswith(prefix):
+            yield os.path.join(parent, name, relative_path)
+
+@lru_cache(maxsize=1)
 def find_pdflatex():
-    """Find the pdflatex executable on the system"""
-    # Try to find pdflatex in common locations
-    possible_paths = [
-        "pdflatex",  # If it's in PATH
-        "/Library/TeX/texbin/pdflatex",  # Standard MacTeX location
-        "/usr/local/texlive/20*/bin/*/pdflatex",  # TeX Live on Unix/Linux
-        "/usr/bin/pdflatex",  # Linux
-        "C:/texlive/20*/bin/win32/pdflatex.exe",  # TeX Live on Windows
-        "C:/Program Files/MiKTeX*/miktex/bin/pdflatex.exe"  # MiKTeX on Windows
-    ]
-    
-    # Try executing pdflatex and see if it works
-    for path in possible_paths:
-        if '*' in path:
-            # Handle wildcards using glob
-            import glob
-            for matched_path in sorted(glob.glob(path), reverse=True):
-                try:
-                    version = subprocess.check_output([matched_path, "--version"], 
-                                                    stderr=subprocess.STDOUT, 
-                                                    universal_newlines=True)
-                    logger.info(f"Found pdflatex at {matched_path}")
-                    return matched_path
-                except (subprocess.SubprocessError, FileNotFoundError):
-                    continue
-        else:
-            try:
-                version = subprocess.check_output([path, "--version"], 
-                                                stderr=subprocess.STDOUT, 
-                                                universal_newlines=True)
-                logger.info(f"Found pdflatex at {path}")
-                return path
-            except (subprocess.SubprocessError, FileNotFoundError):
-                continue
+    """Find the pdflatex executable on the system (cached per process)"""
+    # Most installations put pdflatex in PATH
+    path = shutil.which("pdflatex")
+    if path:
+        logger.info(f"Found pdflatex at {path}")
+        return path
+    
+    # Otherwise try common install locations; the directory scans are lazy
+    # and only run if the locations before them didn't match
+    candidates = chain(
+        ["/Library/TeX/texbin/pdflatex"],  # Standard MacTeX location
+        texlive_candidates("/usr/local/texlive", "pdflatex"),  # TeX Live on Unix/Linux
+        ["/usr/bin/pdflatex"],  # Linux
+        texlive_candidates("C:/texlive", "pdflatex.exe"),  # TeX Live on Windows
+        prefixed_dir_candidates("C:/Program Files", "MiKTeX",
+                                "miktex/bin/pdflatex.exe")  # MiKTeX on Windows
+    )
+    
+    # An existing, executable file is good enough; no need to run it
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            logger.info(f"Found pdflatex at {candidate}")
+            return candidate
     
     logger.error("pdflatex not found. Please install LaTeX (MacTeX, TeX Live, or MiKTeX)")
     return None
 
+@lru_cache(maxsize=1)
 def check_media9_package():
-    """Check if the media9 LaTeX package is installed"""
+    """Return the path to media9.sty if the package is installed (cached per process)"""
     try:
         # Use kpsewhich to check if media9.sty exists
         result = subprocess.run(["kpsewhich", "media9.sty"], 
@@ -122,138 +211,412 @@ def check_media9_package():
                                stderr=subprocess.PIPE, 
                                universal_newlines=True)
         
-        if result.stdout.strip():
-            logger.info(f"Found media9 package at: {result.stdout.strip()}")
-            return True
+        media9_path = result.stdout.strip()
+        if media9_path:
+            logger.info(f"Found media9 package at: {media9_path}")
+            return media9_path
         else:
             logger.warning("media9 LaTeX package not found.")
             logger.warning("Please install it using your TeX package manager:")
             logger.warning("  tlmgr install media9")
-            return False
+            return None
     except (subprocess.SubprocessError, FileNotFoundError):
         logger.warning("Could not check for media9 package. It may not be installed.")
-        return False
+        return None
+
+def failure_marker(format_file):
+    """Return the path of the file marking that a format could not be used"""
+    return os.path.splitext(format_file)[0] + ".failed"
+
+def mark_format_failed(format_file):
+    """Remember that a format could not be built or used, so it isn't tried again"""
+    try:
+        open(failure_marker(format_file), "w").close()
+    except OSError as e:
+        logger.warning(f"Could not mark precompiled LaTeX format as failed: {str(e)}")
 
-def create_latex_file(u3d_path, template=DEFAULT_TEMPLATE, title="3D Model"):
+def remove_stale_formats(format_dir, format_name):
+    """Remove formats and failure markers other than the given format from format_dir"""
+    for name in list_dir(format_dir):
+        if (name.startswith("u3dpdf-") and name.endswith((".fmt", ".failed"))
+                and os.path.splitext(name)[0] != format_name):
+            try:
+                os.unlink(os.path.join(format_dir, name))
+            except OSError:
+                pass
+
+def build_format(pdflatex, template_content, format_dir):
+    """Precompile the static preamble of a template into a pdflatex format"""
+    static_preamble, _ = split_preamble(template_content)
+    if r"\documentclass" not in static_preamble:
+        logger.info("Template preamble cannot be precompiled, compiling without a format")
+        return None
+    
+    try:
+        pdflatex_stat = os.stat(pdflatex)
+    except OSError as e:
+        logger.warning(f"Cannot precompile LaTeX format: {str(e)}")
+        return None
+    
+    # Rebuild the format when the preamble or pdflatex changes, e.g. after a TeX Live upgrade
+    key = "\0".join([pdflatex, str(pdflatex_stat.st_size), str(pdflatex_stat.st_mtime_ns),
+                     static_preamble])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    format_name = f"u3dpdf-{digest}"
+    format_file = os.path.abspath(os.path.join(format_dir, format_name + ".fmt"))
+    if os.path.exists(format_file):
+        logger.info(f"Using precompiled LaTeX format: {format_file}")
+        return format_file
+    if os.path.exists(failure_marker(format_file)):
+        logger.info("Precompiling the LaTeX format failed before, compiling without a format")
+        return None
+    
+    # The format is dumped by mylatexformat from the preamble of a source file.
+    # Build it inside format_dir so it can be renamed into place atomically;
+    # concurrent runs never see a partially written format.
+    try:
+        os.makedirs(format_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=".build-", dir=format_dir)
+    except OSError as e:
+        logger.warning(f"Error precompiling LaTeX format: {str(e)}")
+        return None
+    
+    try:
+        source_file = os.path.join(temp_dir, "preamble.tex")
+        with open(source_file, "w") as f:
+            f.write(static_preamble)
+            f.write(ENDOFDUMP + "\n")
+            f.write("\\begin{document}\n\\end{document}\n")
+        
+        logger.info("Precompiling LaTeX format for the template preamble...")
+        result = subprocess.run([pdflatex,
+                                 "-ini",
+                                 "-interaction=nonstopmode",
+                                 "-jobname=" + format_name,
+                                 "-output-directory=" + temp_dir,
+                                 "&pdflatex",
+                                 "mylatexformat.ltx",
+                                 source_file],
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        
+        built_format = os.path.join(temp_dir, format_name + ".fmt")
+        if result.returncode != 0 or not os.path.exists(built_format):
+            logger.warning("Could not precompile LaTeX format (is the mylatexformat package installed?)")
+            logger.warning("Compiling without a precompiled format")
+            mark_format_failed(format_file)
+            return None
+        
+        os.replace(built_format, format_file)
+        logger.info(f"Created precompiled LaTeX format: {format_file}")
+        remove_stale_formats(format_dir, format_name)
+        return format_file
+    
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Error precompiling LaTeX format: {str(e)}")
+        return None
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+class PrecompiledFormat:
+    """A format from build_format() shared by the documents of a batch"""
+    def __init__(self, path):
+        self.path = path
+    
+    def discard(self):
+        """Stop using the format and delete it"""
+        if self.path is None:
+            return
+        logger.warning(f"Discarding broken precompiled LaTeX format: {self.path}")
+        mark_format_failed(self.path)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.path = None
+
+def read_template(template):
+    """Read a LaTeX template file, None selects the default template"""
+    if not template:
+        return None
+    
+    try:
+        with open(template, 'r') as f:
+            return f.read()
+    except Exception as e:
+        logger.error(f"Error reading template file: {str(e)}")
+        logger.info("Using default template instead")
+        return None
+
+def mark_preamble_end(template_content):
+    """Return a LatexTemplate with the end of the precompiled preamble marked"""
+    static_preamble, rest = split_preamble(template_content)
+    return LatexTemplate(static_preamble + ENDOFDUMP + "\n" + rest)
+
+def create_latex_file(u3d_path, template=DEFAULT_TEMPLATE, title="3D Model", temp_root=None):
     """Create a LaTeX file with the embedded U3D model"""
     # Get absolute path for the U3D file (LaTeX needs this)
     u3d_abs_path = os.path.abspath(u3d_path)
     
-    # Replace placeholders in the template
-    latex_content = template.replace("__TITLE__", title)
-    latex_content = latex_content.replace("__MODEL_PATH__", u3d_abs_path)
+    if not isinstance(template, LatexTemplate):
+        template = LatexTemplate(template)
+    
+    # Replace placeholders in the template in a single pass
+    latex_content = template.substitute(TITLE=title, MODEL_PATH=u3d_abs_path)
     
     # Create a temporary directory for LaTeX compilation
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = tempfile.mkdtemp(prefix=".u3dpdf-", dir=temp_root)
     latex_file = os.path.join(temp_dir, "model.tex")
     
     # Write the LaTeX file
-    with open(latex_file, "w") as f:
+    with open(latex_file, "w", buffering=1 << 16) as f:
         f.write(latex_content)
     
     logger.info(f"Created LaTeX file: {latex_file}")
     return latex_file, temp_dir
 
-def compile_latex(latex_file, output_pdf):
-    """Compile the LaTeX file to create a PDF"""
+def pdflatex_command(latex_file, pdflatex, format_file=None):
+    """Build the pdflatex command line and environment for compiling a LaTeX file"""
+    # Write all output next to the LaTeX file
+    latex_dir = os.path.dirname(latex_file)
+    
+    command = [pdflatex, "-interaction=nonstopmode", "-output-directory=" + latex_dir]
+    env = None
+    if format_file:
+        # Let kpathsea find the format next to the default search path
+        format_name = os.path.splitext(os.path.basename(format_file))[0]
+        command.append("-fmt=" + format_name)
+        env = dict(os.environ)
+        env["TEXFORMATS"] = os.path.dirname(format_file) + os.pathsep + env.get("TEXFORMATS", "")
+    command.append(latex_file)
+    
+    return command, env
+
+def read_log_tail(latex_file, max_lines=40):
+    """Return the last lines of the pdflatex log for a LaTeX file"""
+    log_file = os.path.splitext(latex_file)[0] + ".log"
+    try:
+        with open(log_file, "r", errors="replace") as f:
+            return "".join(deque(f, maxlen=max_lines))
+    except OSError:
+        return ""
+
+def store_compiled_pdf(latex_file, output_pdf):
+    """Move the PDF compiled from a LaTeX file to the output location"""
+    # Get the output PDF path from the LaTeX compilation
+    compiled_pdf = os.path.splitext(latex_file)[0] + ".pdf"
+    
+    # Create output directory if it doesn't exist
+    output_dir = os.path.dirname(output_pdf)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # Move the compiled PDF to the desired output location
+    try:
+        os.replace(compiled_pdf, output_pdf)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(compiled_pdf, output_pdf)
+        os.unlink(compiled_pdf)
+    logger.info(f"Successfully created 3D PDF: {output_pdf}")
+
+def remove_aux_files(latex_file):
+    """Clean up the LaTeX auxiliary files of a LaTeX file but keep the temp directory"""
+    stem = os.path.splitext(os.path.basename(latex_file))[0]
+    with os.scandir(os.path.dirname(latex_file)) as entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[0] == stem and entry.name.endswith(AUX_EXTENSIONS):
+                os.unlink(entry.path)
+
+async def run_pdflatex(command, env=None, semaphore=None):
+    """Run pdflatex with its output discarded and return the exit code"""
+    # The semaphore is held only while pdflatex runs
+    if semaphore is not None:
+        async with semaphore:
+            return await run_pdflatex(command, env)
+    
+    process = await asyncio.create_subprocess_exec(*command,
+                                                   env=env,
+                                                   stdout=asyncio.subprocess.DEVNULL,
+                                                   stderr=asyncio.subprocess.DEVNULL)
+    return await process.wait()
+
+async def compile_latex_async(latex_file, output_pdf, pdflatex=None, max_passes=MAX_PASSES,
+                              shared_format=None, semaphore=None):
+    """Compile the LaTeX file to create a PDF without blocking the event loop"""
     # Find pdflatex
-    pdflatex = find_pdflatex()
+    if not pdflatex:
+        pdflatex = find_pdflatex()
     if not pdflatex:
         return False
     
-    # Get the directory containing the LaTeX file
-    latex_dir = os.path.dirname(latex_file)
+    format_file = shared_format.path if shared_format else None
+    command, env = pdflatex_command(latex_file, pdflatex, format_file)
     
     try:
-        # Run pdflatex twice to ensure all references are resolved
-        for i in range(2):
-            logger.info(f"Running pdflatex (pass {i+1}/2)...")
-            result = subprocess.run([pdflatex, 
-                                   "-interaction=nonstopmode", 
-                                   "-output-directory=" + latex_dir,
-                                   latex_file], 
-                                   stdout=subprocess.PIPE, 
-                                   stderr=subprocess.STDOUT, 
-                                   universal_newlines=True)
+        # Run pdflatex as often as needed to resolve all references
+        for i in range(max_passes):
+            logger.info(f"Running pdflatex (pass {i+1})...")
+            returncode = await run_pdflatex(command, env, semaphore)
             
-            # Check if compilation was successful
-            if result.returncode != 0:
-                logger.error("LaTeX compilation failed")
-                logger.error(result.stdout)
+            # A broken or stale format must not fail the document
+            if returncode != 0 and format_file and i == 0:
+                logger.warning(f"pdflatex failed with the precompiled format, retrying without it: {latex_file}")
+                format_file = None
+                command, env = pdflatex_command(latex_file, pdflatex)
+                returncode = await run_pdflatex(command, env, semaphore)
+                # Only the format failed, so stop using it for the whole batch
+                if returncode == 0:
+                    shared_format.discard()
+            
+            # Check if compilation was successful, the log file has the details
+            if returncode != 0:
+                logger.error(f"LaTeX compilation failed: {latex_file}")
+                log_tail = read_log_tail(latex_file)
+                if log_tail:
+                    logger.error(log_tail)
                 return False
+            
+            if not needs_rerun(latex_file):
+                break
         
-        # Get the output PDF path from the LaTeX compilation
-        compiled_pdf = os.path.splitext(latex_file)[0] + ".pdf"
-        
-        # Create output directory if it doesn't exist
-        output_dir = os.path.dirname(output_pdf)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        # Copy the compiled PDF to the desired output location
-        shutil.copy2(compiled_pdf, output_pdf)
-        logger.info(f"Successfully created 3D PDF: {output_pdf}")
-        
+        store_compiled_pdf(latex_file, output_pdf)
         return True
     
     except Exception as e:
         logger.error(f"Error during LaTeX compilation: {str(e)}")
         return False
     finally:
-        # Clean up LaTeX auxiliary files but keep the temp directory
-        for ext in ['.aux', '.log', '.out']:
-            aux_file = os.path.splitext(latex_file)[0] + ext
-            if os.path.exists(aux_file):
-                os.unlink(aux_file)
+        remove_aux_files(latex_file)
 
-def generate_3d_pdf(u3d_file, output_pdf, title=None, template=None):
-    """Generate a 3D PDF from a U3D file using LaTeX"""
-    # Verify the U3D file exists
-    if not os.path.exists(u3d_file):
-        logger.error(f"U3D file not found: {u3d_file}")
+def compile_latex(latex_file, output_pdf, pdflatex=None, max_passes=MAX_PASSES, format_file=None):
+    """Compile the LaTeX file to create a PDF"""
+    # Find pdflatex
+    if not pdflatex:
+        pdflatex = find_pdflatex()
+    if not pdflatex:
         return False
     
-    # Check if media9 package is available
-    check_media9_package()
+    command, env = pdflatex_command(latex_file, pdflatex, format_file)
+    
+    try:
+        # Run pdflatex as often as needed to resolve all references
+        for i in range(max_passes):
+            logger.info(f"Running pdflatex (pass {i+1})...")
+            returncode = subprocess.run(command, env=env,
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL).returncode
+            
+            # A broken or stale format must not fail the document
+            if returncode != 0 and format_file and i == 0:
+                logger.warning(f"pdflatex failed with the precompiled format, retrying without it: {latex_file}")
+                format_file = None
+                command, env = pdflatex_command(latex_file, pdflatex)
+                returncode = subprocess.run(command, env=env,
+                                            stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL).returncode
+            
+            # Check if compilation was successful, the log file has the details
+            if returncode != 0:
+                logger.error(f"LaTeX compilation failed: {latex_file}")
+                log_tail = read_log_tail(latex_file)
+                if log_tail:
+                    logger.error(log_tail)
+                return False
+            
+            if not needs_rerun(latex_file):
+                break
+        
+        store_compiled_pdf(latex_file, output_pdf)
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error during LaTeX compilation: {str(e)}")
+        return False
+    finally:
+        remove_aux_files(latex_file)
+
+def prepare_latex_file(u3d_file, output_pdf, title=None, template_content=None, format_file=None,
+                       skip_validation=False):
+    """Create the LaTeX file for a U3D model next to the output PDF"""
+    # Verify the U3D file exists, unless the caller already did
+    if not skip_validation and not os.path.exists(u3d_file):
+        logger.error(f"U3D file not found: {u3d_file}")
+        return None
     
     # Use default title if not provided
     if not title:
         title = os.path.splitext(os.path.basename(u3d_file))[0].replace('_', ' ').title()
     
     # Use default template if not provided
-    if not template:
-        template_content = DEFAULT_TEMPLATE
+    if template_content is None:
+        template = DEFAULT_TEMPLATE
+    elif isinstance(template_content, LatexTemplate):
+        template = template_content
     else:
-        # Read template from file
-        try:
-            with open(template, 'r') as f:
-                template_content = f.read()
-        except Exception as e:
-            logger.error(f"Error reading template file: {str(e)}")
-            logger.info("Using default template instead")
-            template_content = DEFAULT_TEMPLATE
+        template = LatexTemplate(template_content)
     
-    # Create LaTeX file
-    latex_file, temp_dir = create_latex_file(u3d_file, template_content, title)
+    if format_file and ENDOFDUMP not in template.template:
+        template = mark_preamble_end(template.template)
     
+    # Create output directory if it doesn't exist
+    output_dir = os.path.dirname(os.path.abspath(output_pdf))
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Create LaTeX file next to the output, so the PDF can be renamed into place
+    return create_latex_file(u3d_file, template, title, output_dir)
+
+def report_result(success, output_pdf, temp_dir):
+    """Log the outcome of a conversion and remove its temporary directory"""
+    if success:
+        logger.info(f"3D PDF successfully created: {output_pdf}")
+        logger.info("View the PDF in Adobe Acrobat Reader to see the 3D model")
+    else:
+        logger.error("Failed to create 3D PDF")
+    
+    # Clean up temporary directory after we're done
+    try:
+        shutil.rmtree(temp_dir)
+    except Exception as e:
+        logger.warning(f"Failed to clean up temporary directory: {str(e)}")
+
+async def generate_3d_pdf_async(u3d_file, output_pdf, title=None, template_content=None,
+                                pdflatex=None, shared_format=None, skip_validation=False,
+                                semaphore=None):
+    """Generate a 3D PDF from a U3D file using LaTeX without blocking the event loop"""
+    format_file = shared_format.path if shared_format else None
+    prepared = prepare_latex_file(u3d_file, output_pdf, title, template_content, format_file,
+                                  skip_validation)
+    if not prepared:
+        return False
+    latex_file, temp_dir = prepared
+    
+    success = False
     try:
         # Compile LaTeX file
-        success = compile_latex(latex_file, output_pdf)
-        
-        if success:
-            logger.info(f"3D PDF successfully created: {output_pdf}")
-            logger.info("View the PDF in Adobe Acrobat Reader to see the 3D model")
-        else:
-            logger.error("Failed to create 3D PDF")
-        
+        success = await compile_latex_async(latex_file, output_pdf, pdflatex,
+                                            shared_format=shared_format, semaphore=semaphore)
         return success
+    finally:
+        report_result(success, output_pdf, temp_dir)
+
+def generate_3d_pdf(u3d_file, output_pdf, title=None, template_content=None, pdflatex=None,
+                    format_file=None, skip_validation=False):
+    """Generate a 3D PDF from a U3D file using LaTeX"""
+    prepared = prepare_latex_file(u3d_file, output_pdf, title, template_content, format_file,
+                                  skip_validation)
+    if not prepared:
+        return False
+    latex_file, temp_dir = prepared
     
+    success = False
+    try:
+        # Compile LaTeX file
+        success = compile_latex(latex_file, output_pdf, pdflatex, format_file=format_file)
+        return success
     finally:
-        # Clean up temporary directory after we're done
-        try:
-            shutil.rmtree(temp_dir)
-        except Exception as e:
-            logger.warning(f"Failed to clean up temporary directory: {str(e)}")
+        report_result(success, output_pdf, temp_dir)
 
 def main():
     parser = argparse.ArgumentParser(description="Create 3D PDFs from U3D files using LaTeX")
@@ -291,8 +654,11 @@ def main():
     else:
         pdf_path = args.output_pdf
     
+    # Check if media9 package is available
+    check_media9_package()
+    
     # Generate the 3D PDF
-    success = generate_3d_pdf(u3d_path, pdf_path, args.title, args.template)
+    success = generate_3d_pdf(u3d_path, pdf_path, args.title, read_template(args.template))
     
     if not success:
         sys.exit(1)
@@ -23,6 +23,9 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Application name used with 'open -a' on macOS if no Acrobat binary is found
+ACROBAT_APP_NAME = 'Adobe Acrobat Reader'
+
 def find_acrobat_reader():
     """Try to find Adobe Acrobat Reader on the system"""
     system = platform.system()
@@ -41,8 +44,8 @@ def find_acrobat_reader():
                 logger.info(f"Found Acrobat Reader at: {path}")
                 return path
                 
-        # Try using the 'open' command with the specific app
-        return 'open -a "Adobe Acrobat Reader"'
+        # Fall back to the app name, opened with 'open -a'
+        return ACROBAT_APP_NAME
         
     elif system == 'Windows':
         # Common Acrobat Reader locations on Windows
@@ -82,16 +85,18 @@ def open_pdf(pdf_path):
         logger.error(f"PDF file not found: {pdf_path}")
         return False
     
+    system = platform.system()
+    
     # First try to find Adobe Acrobat Reader
     acrobat = find_acrobat_reader()
     
     if acrobat:
         try:
-            if platform.system() == 'Darwin' and acrobat.startswith('open'):
+            if system == 'Darwin' and acrobat == ACROBAT_APP_NAME:
                 # Special case for macOS using 'open -a'
-                command = f'{acrobat} "{pdf_path}"'
-                logger.info(f"Opening PDF with command: {command}")
-                os.system(command)
+                command = ['open', '-a', acrobat, pdf_path]
+                logger.info(f"Opening PDF with command: {' '.join(command)}")
+                subprocess.Popen(command)
             else:
                 # Normal case - direct path to executable
                 logger.info(f"Opening PDF with Acrobat Reader: {pdf_path}")
@@ -104,9 +109,9 @@ def open_pdf(pdf_path):
     try:
         logger.info("Acrobat Reader not found, trying system default PDF viewer")
         
-        if platform.system() == 'Darwin':  # macOS
+        if system == 'Darwin':  # macOS
             subprocess.Popen(['open', pdf_path])
-        elif platform.system() == 'Windows':  # Windows
+        elif system == 'Windows':  # Windows
             os.startfile(pdf_path)
         else:  # Linux
             subprocess.Popen(['xdg-open', pdf_path])